@@ -112,16 +112,28 @@ v0.2 - changed the availability to match will, single availability for all senso
 """
 
 import time
+import errno
 import logging
+import threading
 import usb.core
 import usb.util
 import sys
-import traceback
 import struct
 import json
+import functools
 import usb
 import paho.mqtt.client as mqtt
 
+# orjson is optional, it serializes the MQTT payloads faster than the stdlib json
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    # compact separators, matches orjson and keeps the state payload small
+    json_dumps = functools.partial(json.dumps, separators=(',', ':'))
+
 DRIVER_VERSION = "0.2"
 
 # set MQTT vars
@@ -134,43 +146,84 @@ MQTT_PASSWORD     = ""
 # looking to get resultant topic like weather/ws-2902c/[item]
 MQTT_TOPIC_PREFIX = "home"
 MQTT_TOPIC           = MQTT_TOPIC_PREFIX + "/ws-3000"
+# availability topic, shared by the LWT and every HA discovery config
+MQTT_STATUS_TOPIC    = f"{MQTT_TOPIC_PREFIX}/status"
+# all values of a poll are published as one JSON document on this topic,
+# set MQTT_JSON_STATE to False to publish each value on its own topic instead
+MQTT_STATE_TOPIC     = sys.intern(MQTT_TOPIC + "/state")
+MQTT_JSON_STATE      = True
+
+# record keys for the 8 channels, built once rather than on every poll
+_TEMP_KEYS = tuple(f"temperature_CH{ch}" for ch in range(1, 9))
+_HUM_KEYS = tuple(f"humidity_CH{ch}" for ch in range(1, 9))
+
+# per value topics, built once rather than on every publish. paho only takes str
+# topics, so they are interned instead of being pre-encoded to bytes
+_TOPIC_CACHE = {key: sys.intern(MQTT_TOPIC + f"/{key}") for key in ('units',) + _TEMP_KEYS + _HUM_KEYS}
 
 log = logging.getLogger(__name__)
 
+# the 8 channels of a sensor_values frame: big-endian signed short temperature
+# followed by the humidity byte, decoded in a single call
+_SENSORS_STRUCT = struct.Struct('>' + 'hB' * 8)
+
 
 def logmsg(level, msg):
     # syslog.syslog(level, 'ws3000: %s' % msg)
     log.debug(msg)
 
 
-def logdbg(msg):
+# The helpers pass their arguments through to the logger, which only applies
+# the %-formatting when the record is actually emitted.
+def logdbg(msg, *args):
     # logmsg(syslog.LOG_DEBUG, msg)
-    log.debug(msg)
+    log.debug(msg, *args)
 
 
-def loginf(msg):
+def loginf(msg, *args):
     # logmsg(syslog.LOG_INFO, msg)
-    log.info(msg)
+    log.info(msg, *args)
+
+
+def logwarn(msg, *args):
+    # logmsg(syslog.LOG_WARNING, msg)
+    log.warning(msg, *args)
 
 
-def logerr(msg):
+def logerr(msg, *args):
     # logmsg(syslog.LOG_ERR, msg)
-    log.error(msg)
+    log.error(msg, *args)
+
+
+def logexc(msg, *args):
+    """Like logerr, with the traceback of the exception being handled"""
+    log.exception(msg, *args)
 
 
 def tohex(buf):
     """Helper function used to print a byte array in hex format"""
     if buf:
-        return "%s (len=%s)" % (' '.join(["%02x" % x for x in buf]), len(buf))
+        return "%s (len=%s)" % (bytes(buf).hex(' '), len(buf))
     return ''
 
 
+class _HexRepr():
+    """Defers tohex() until the logger actually emits the message"""
+    __slots__ = ('buf',)
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def __str__(self):
+        return tohex(self.buf)
+
+
 # mostly copied + pasted from https://www.emqx.io/blog/how-to-use-mqtt-in-python and some of my own MQTT scripts
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        loginf(f"connected to MQTT broker at {MQTT_BROKER_HOST}")
+        loginf("connected to MQTT broker at %s", MQTT_BROKER_HOST)
     else:
-        logerr("Failed to connect, return code %d\n", rc)
+        logerr("Failed to connect, return code %d", rc)
 
 def on_disconnect(client, userdata, rc):
     loginf("disconnected from MQTT broker")
@@ -180,12 +233,20 @@ client = mqtt.Client(client_id=MQTT_CLIENT_ID)
 if MQTT_USERNAME and MQTT_PASSWORD:
     client.username_pw_set(MQTT_USERNAME,MQTT_PASSWORD)
     print("Username and password set.")
-client.will_set(MQTT_TOPIC_PREFIX+"/status", payload="offline", qos=2, retain=True) # set LWT     
+client.will_set(MQTT_STATUS_TOPIC, payload="offline", qos=2, retain=True) # set LWT     
 client.on_connect = on_connect # on connect callback
 client.on_disconnect = on_disconnect # on disconnect callback
+# cap the QoS>0 messages (the QoS 2 'online' status) paho keeps queued while
+# disconnected, the default of 0 lets that queue grow without limit
+client.max_queued_messages_set(1000)
+# paho's network thread retries the broker every 1 to 30 seconds instead of
+# backing off up to the default 120, so publishing resumes sooner after an outage
+client.reconnect_delay_set(min_delay=1, max_delay=30)
 
 def publish(client, topic, msg):
-    result = client.publish(topic, msg)
+    # QoS 0: the message is only queued here, paho's network thread started by
+    # loop_start() sends it without waiting for any acknowledgement
+    result = client.publish(topic, msg, qos=0)
     # result: [0, 1]
     status = result[0]
 
@@ -208,6 +269,7 @@ class WS3000():
         'humidity_alarm_configuration': 0x09,
         'device_configuration': 0x04
     }
+    INV_COMMANDS = {v: k for k, v in COMMANDS.items()}
 
     def __init__(self, **stn_dict):
         """Initialize an object of type WS3000.
@@ -252,7 +314,7 @@ class WS3000():
         self.IN_ep = 0x82
         self.OUT_ep = 0x1
 
-        loginf('driver version is %s' % DRIVER_VERSION)
+        loginf('driver version is %s', DRIVER_VERSION)
         self.model = stn_dict.get('model', 'WS3000')
         self.record_generation = stn_dict.get('record_generation', 'software')
         self.timeout = int(stn_dict.get('timeout', 1000))
@@ -267,6 +329,19 @@ class WS3000():
 
         self.device = None
         self.units = 'Celsius'
+        self._stop = threading.Event()
+        # device found by the last bus scan, reused by _find_device while it still answers
+        self._last_device_ref = None
+        # only reset the device when reopening after an error, not on a cold start
+        self._needs_reset = False
+        # (OUT, IN) endpoint addresses, resolved from the descriptors on the first open
+        self._ep_addrs = None
+
+        # request frames are fixed for each command so build them once, Windows
+        # needs them padded to a full 64 byte report
+        pad = bytes(60) if self.mode == 'Windows' else b''
+        self._cmd_frames = {code: bytes((0x7b, code, 0x40, 0x7d)) + pad
+                            for code in self.COMMANDS.values()}
         self.open_port()
 
     def open_port(self):
@@ -283,13 +358,17 @@ class WS3000():
         # this requires a re-initialization back to an 'int' if a commucation retry occurs.
         self.interface = 0
         if not self.device:
-            logerr("Unable to find USB device (0x%04x, 0x%04x)" %
-                   (self.vendor_id, self.product_id))
-        for line in str(self.device).splitlines():
-            logdbg(line)
+            logerr("Unable to find USB device (0x%04x, 0x%04x)",
+                   self.vendor_id, self.product_id)
+        # str() of a pyusb device walks every descriptor, only do it when it will be shown
+        if log.isEnabledFor(logging.DEBUG):
+            for line in str(self.device).splitlines():
+                logdbg(line)
 
         # reset device, required if it was previously left in a 'bad' state
-        self.device.reset()
+        if self._needs_reset:
+            self.device.reset()
+            self._needs_reset = False
 
         # Detach any interfaces claimed by the kernel only if not in Windows
         if self.mode != 'Windows':
@@ -297,30 +376,41 @@ class WS3000():
                 print("Detaching kernel driver")
                 self.device.detach_kernel_driver(self.interface)
 
-        # get the interface and IN and OUT end points
         self.device.set_configuration()
-        configuration = self.device.get_active_configuration()
-        self.interface = usb.util.find_descriptor(
-             configuration, bInterfaceNumber=self.interface
-        ) # following this call, the interface is no longer an int...
-        self.OUT_ep = usb.util.find_descriptor(
-            self.interface,
-            # match the first OUT endpoint
-            custom_match=lambda eo: \
-            usb.util.endpoint_direction(eo.bEndpointAddress) == usb.util.ENDPOINT_OUT)
-        self.IN_ep = usb.util.find_descriptor(
-            self.interface,
-            # match the first OUT endpoint
-            custom_match=lambda ei: \
-            usb.util.endpoint_direction(ei.bEndpointAddress) == \
-            usb.util.ENDPOINT_IN)
+        if self._ep_addrs is None:
+            # get the interface and IN and OUT end points
+            configuration = self.device.get_active_configuration()
+            self.interface = usb.util.find_descriptor(
+                 configuration, bInterfaceNumber=self.interface
+            ) # following this call, the interface is no longer an int...
+            self.OUT_ep = usb.util.find_descriptor(
+                self.interface,
+                # match the first OUT endpoint
+                custom_match=lambda eo: \
+                usb.util.endpoint_direction(eo.bEndpointAddress) == usb.util.ENDPOINT_OUT)
+            self.IN_ep = usb.util.find_descriptor(
+                self.interface,
+                # match the first OUT endpoint
+                custom_match=lambda ei: \
+                usb.util.endpoint_direction(ei.bEndpointAddress) == \
+                usb.util.ENDPOINT_IN)
+            if self.OUT_ep is not None and self.IN_ep is not None:
+                self._ep_addrs = (self.OUT_ep.bEndpointAddress, self.IN_ep.bEndpointAddress)
+                # the console always answers with a 64 byte report, just note an unusual endpoint
+                if self.IN_ep.wMaxPacketSize != self.packet_size:
+                    logdbg("IN endpoint wMaxPacketSize is %d bytes, reading %d byte reports",
+                           self.IN_ep.wMaxPacketSize, self.packet_size)
+        else:
+            # reopening the same station: its endpoints don't move, and pyusb accepts
+            # the plain addresses, so skip walking the configuration descriptors again
+            self.OUT_ep, self.IN_ep = self._ep_addrs
 
         # The following is normally not required... could be removed?
         try:
             usb.util.claim_interface(self.device, self.interface)
         except usb.USBError as e:
             self.closePort()
-            logerr("Unable to claim USB interface: %s" % e)
+            logerr("Unable to claim USB interface: %s", e)
 
         loginf("WS-3000 initialization complete")
 
@@ -330,6 +420,8 @@ class WS3000():
         if self.mode == 'simulation':
             return
 
+        # whoever opens the port next recovers from whatever state we leave it in
+        self._needs_reset = True
         try:
             usb.util.dispose_resources(self.device)
         except usb.USBError:
@@ -344,6 +436,7 @@ class WS3000():
         example, since a single measurement would be required in such a case."""
 
         nberrors = 0
+        softerrors = 0
         while nberrors < self.max_tries:
             # Get a stream of raw packets, then convert them
             try:
@@ -353,39 +446,66 @@ class WS3000():
                 if not raw_data:  # empty record
                     raise Exception("Failed to get any data from the station")
                 formatted_data = self._raw_to_data(raw_data, read_sensors_command)
-                logdbg('data: %s' % formatted_data)
+                logdbg('data: %s', formatted_data)
                 #new_packet = self._data_to_wxpacket(formatted_data)
                 #logdbg('packet: %s' % new_packet)
                 #return new_packet
                 return formatted_data
-            except (usb.USBError, Exception) as e:
-                exc_traceback = traceback.format_exc()
-                logerr("WS-3000: An error occurred while generating loop packets")
-                logerr(exc_traceback)
+            except usb.USBError as e:
+                # A timeout leaves the device attached and configured, clearing the IN
+                # endpoint is enough to read again. Once max_tries timeouts have been
+                # spent this way, or on real failures (ENODEV, EIO, ...), go through
+                # the full reopen below.
+                if e.errno in (None, errno.ETIMEDOUT) and softerrors < self.max_tries:
+                    softerrors += 1
+                    logwarn("WS-3000: USB timeout while reading the station, retrying: %s", e)
+                    try:
+                        self.device.clear_halt(self.IN_ep)
+                    except usb.USBError:
+                        pass
+                    continue
+                logexc("WS-3000: An error occurred while generating loop packets")
                 nberrors += 1
+                if e.errno == errno.ENODEV:
+                    # the station went away, look for it on the bus again
+                    self._last_device_ref = None
                 # The driver seem to 'loose' connectivity with the station from time to time.
                 # Trying to close/reopen the USB port to fix the problem.
                 self.closePort()
                 self.open_port()
                 time.sleep(self.wait_before_retry)
+            except Exception:
+                # Short or malformed frame, the USB link itself is fine so just read again
+                logexc("WS-3000: An error occurred while generating loop packets")
+                nberrors += 1
+                time.sleep(0.1)
         logerr("Max retries exceeded while fetching USB reports")
-        traceback.print_exc(file=sys.stdout)
 
     def genLoopPackets(self):
         """Generator function that continuously returns loop packets"""
         try:
-            while True:
+            while not self._stop.is_set():
+                # keep a fixed poll period, the time spent reading and publishing
+                # comes out of the wait (monotonic so clock changes don't matter)
+                start = time.monotonic()
                 loop_packet = self.get_current_values()
                 yield loop_packet
-                time.sleep(self.loop_interval)
+                delay = self.loop_interval - (time.monotonic() - start)
+                # wait on the event rather than sleeping so stop() ends the loop right away
+                if delay > 0:
+                    self._stop.wait(delay)
         except GeneratorExit:
             pass
 
+    def stop(self):
+        """Ask genLoopPackets to return instead of waiting for the next poll"""
+        self._stop.set()
+
     def getDeviceConfig(self):
         """Send command to read the station configuration
         Two pieces of information are saved: the units the station is set to,
-        and try to determine the number of sensors attached which will go on
-        to help set the number of HA discovery messages to send"""
+        and try to determine which sensors are attached which will go on
+        to help set which HA discovery messages to send"""
         try:
             # Read the station config
             command = self.COMMANDS["device_configuration"]
@@ -401,13 +521,13 @@ class WS3000():
             command = self.COMMANDS["sensor_values"]
             raw = self._get_raw_data(command)
             data2 = self._raw_to_data(raw, command)
-            # Try to determine the number of sensors available
-            data['sensorNum'] = int((len(data2) - 1)/2)
+            # Channels that reported a temperature or a humidity, these get HA discovery
+            data['sensors'] = [ch for ch, (temp_key, hum_key) in enumerate(zip(_TEMP_KEYS, _HUM_KEYS), 1)
+                               if temp_key in data2 or hum_key in data2]
+            data['sensorNum'] = len(data['sensors'])
             return data
-        except (usb.USBError, Exception) as e:
-            exc_traceback = traceback.format_exc()
-            logerr("WS-3000: An error occurred while generating loop packets")
-            logerr(exc_traceback)
+        except Exception:
+            logexc("WS-3000: An error occurred while reading the station configuration")
 
     @property
     def hardware_name(self):
@@ -419,35 +539,43 @@ class WS3000():
 
     def _find_device(self):
         """Find the given vendor and product IDs on the USB bus"""
+        # On a reopen the station is normally still where we left it, check the
+        # previous handle is alive before walking the whole bus again
+        if self._last_device_ref is not None:
+            try:
+                self._last_device_ref.get_active_configuration()
+                return self._last_device_ref
+            except usb.USBError:
+                self._last_device_ref = None
         device = usb.core.find(idVendor=self.vendor_id, idProduct=self.product_id)
+        self._last_device_ref = device
         return device
 
     def _write_usb(self, buf):
-        logdbg("write: %s - timeout: %d" % (tohex(buf), self.timeout))
-        if self.mode == 'Windows':
-            buf = buf + (64-len(buf))*[0]
+        logdbg("write: %s - timeout: %d", _HexRepr(buf), self.timeout)
+        if self.mode == 'Windows' and len(buf) < 64:
+            buf = bytes(buf) + bytes(64 - len(buf))
         # NB: timeout increased from 100 to 1000 to avoid failure on RPi
         return self.device.write(self.OUT_ep, data=buf, timeout=self.timeout)
 
     def _read_usb(self):
-        logdbg("reading " + str(self.packet_size) + " bytes")
+        logdbg("reading %d bytes", self.packet_size)
         buf = self.device.read(self.IN_ep, self.packet_size, timeout=self.timeout)
         if not buf:
             return None
-        logdbg("read: %s" % tohex(buf))
+        # one copy out of the usb array, every check below works on the same bytes
+        buf = bytes(buf)
+        logdbg("read: %s", _HexRepr(buf))
         if len(buf) != 64:
-            logdbg('read: bad buffer length: %s != 64' % len(buf))
+            logdbg('read: bad buffer length: %s != 64', len(buf))
             return None
         if buf[0] != 0x7b:
-            logdbg('read: bad first byte: 0x%02x != 0x7b' % buf[0])
+            logdbg('read: bad first byte: 0x%02x != 0x7b', buf[0])
             return None
-        idx = None
-        for i in range(0, len(buf) - 1):
-            if buf[i] == 0x40 and buf[i + 1] == 0x7d:
-                idx = i
-                break
-        if idx is None:
-            logdbg('read: no terminating bytes in buffer: %s' % tohex(buf))
+        # let bytes.find locate the 0x40 0x7d terminator instead of a python loop
+        idx = buf.find(b'\x40\x7d')
+        if idx == -1:
+            logdbg('read: no terminating bytes in buffer: %s', _HexRepr(buf))
             return None
         return buf[0: idx + 2]
 
@@ -456,49 +584,55 @@ class WS3000():
     # ==========================================================================
 
     def _get_cmd_name(self, hex_command):
-        return list(self.COMMANDS.keys())[list(self.COMMANDS.values()).index(hex_command)]
+        return self.INV_COMMANDS[hex_command]
 
     def _get_raw_data(self, hex_command=COMMANDS['sensor_values']):
         """Get a sequence of bytes from the console."""
-        sequence = [0x7b, hex_command, 0x40, 0x7d]
         try:
-            logdbg("sending request for " + self._get_cmd_name(hex_command))
-            self._write_usb(sequence)
+            logdbg("sending request for %s", self._get_cmd_name(hex_command))
+            self._write_usb(self._cmd_frames[hex_command])
             logdbg("reading results...")
             buf = self._read_usb()
             return buf
+        except usb.USBError:
+            # let the caller decide whether the port needs to be reopened
+            raise
         except Exception:
-            exc_traceback = traceback.format_exc()
-            logerr("WS-3000: An error occurred while fetching data")
-            logerr(exc_traceback)
-            traceback.print_exc(file=sys.stdout)
+            logexc("WS-3000: An error occurred while fetching data")
 
     def _raw_to_data(self, buf, hex_command=COMMANDS['sensor_values']):
         """Convert the raw bytes sent by the console to human readable values."""
-        logdbg("extracting values for " + self._get_cmd_name(hex_command))
-        logdbg("raw: %s" % buf)
+        logdbg("extracting values for %s", self._get_cmd_name(hex_command))
+        logdbg("raw: %s", buf)
         record = dict()
         if not buf:
             return record
-        if hex_command == self.COMMANDS['sensor_values']:
+        commands = self.COMMANDS
+        if hex_command == commands['sensor_values']:
             if len(buf) != 27:
                 raise Exception("Incorrect buffer length, failed to read " + self._get_cmd_name(hex_command))
-            record['units'] = self.units
-            for ch in range(8):
-                idx = 1 + ch * 3
-                if buf[idx] != 0x7f and buf[idx + 1] != 0xff:
+            units = self.units
+            channels = dict()
+            values = _SENSORS_STRUCT.unpack_from(buf, 1)
+            # the station units don't change within a frame, so pick the conversion once
+            fahrenheit = units == 'Fahrenheit'
+            for temp_key, hum_key, temp, hum in zip(_TEMP_KEYS, _HUM_KEYS, values[0::2], values[1::2]):
+                # 0x7fff is the 'no sensor' marker, any other value is a reading
+                if temp != 0x7fff:
                     # The formula below has been changed compared to the original code
                     # to properly handle negative temperature values.
                     # The station seems to provide the temperature as an unsigned short (2 bytes),
                     # so struct.unpack is used for the conversion to decimal.
                     # record['t_%s' % (ch + 1)] = (buf[idx] * 256 + buf[idx + 1]) / 10.0 # this doesn't handle negative values correctly
-                    if self.units == 'Fahrenheit':
-                        record[f'temperature_CH{ch + 1}'] = round((struct.unpack('>h', buf[idx:idx+2])[0] * 0.18) + 32, 2)
-                    else:
-                        record[f'temperature_CH{ch + 1}'] = struct.unpack('>h', buf[idx:idx+2])[0] / 10.0
-                if buf[idx + 2] != 0xff:
-                    record[f'humidity_CH{ch + 1}'] = buf[idx + 2]
-        elif hex_command == self.COMMANDS['device_configuration']:
+                    # tenths of a degree C, so F = temp * 0.18 + 32
+                    channels[temp_key] = round((temp * 0.18) + 32, 2) if fahrenheit else temp / 10.0
+                if hum != 0xff:
+                    channels[hum_key] = hum
+            # nothing to report (and publish) until at least one sensor is heard from
+            if channels:
+                record['units'] = units
+                record.update(channels)
+        elif hex_command == commands['device_configuration']:
             if len(buf) != 30:
                 raise Exception("Incorrect buffer length, failed to read " + self._get_cmd_name(hex_command))
             record['type'] = self._get_cmd_name(hex_command)
@@ -507,67 +641,93 @@ class WS3000():
             else:
                 record['units'] = 'C'
         else:
-            logdbg("unknown data: %s" % tohex(buf))
+            logdbg("unknown data: %s", _HexRepr(buf))
         return record
 
 def publish_results(result):
     """ result is a dict. full list of variables include:
-    Temperature_CH[1-8]: temp_data, Humidity_CH[1-8]: hum_data"""
+    Temperature_CH[1-8]: temp_data, Humidity_CH[1-8]: hum_data, units"""
+
+    # no sensor reported (or the station could not be read), nothing to send
+    if not result:
+        return
+
+    if MQTT_JSON_STATE:
+        # a single PUBLISH for the whole poll, HA extracts each value with a value_template
+        msg = json_dumps(result)
+        logdbg("attempting to publish to %s with message %s", MQTT_STATE_TOPIC, msg)
+        publish(client, MQTT_STATE_TOPIC, msg)
+        return
 
     # we're just going to publish everything. less coding.
+    # Build all the messages first, then queue them back to back so paho's network
+    # thread finds the whole batch waiting and flushes it in one pass
+    batch = []
     for key in result:
         #print(f"{key}: {result[key]}")
         # resultant topic is home/ws-3000/temperature_CHn or humidity_CHn
-        specific_topic = MQTT_TOPIC + f"/{key}"
+        specific_topic = _TOPIC_CACHE.get(key) or f"{MQTT_TOPIC}/{key}"
         msg = str(result[key])
-        logdbg(f"attempting to publish to {specific_topic} with message {msg}")
+        logdbg("attempting to publish to %s with message %s", specific_topic, msg)
+        batch.append((specific_topic, msg))
+    for specific_topic, msg in batch:
         publish(client, specific_topic, msg)
 
+@functools.lru_cache(maxsize=None)
+def discovery_payloads(ch, units, json_state):
+    """Return the serialized HA discovery configs (temperature, humidity) for one channel.
+    They only depend on the arguments, so repeated discovery publishes reuse the JSON."""
+    payloadT = {
+        "unique_id": f"ws3000_temp_ch{ch}",
+        "name": f"Temperature Sensor {ch}",
+        "state_topic": MQTT_TOPIC + f"/temperature_CH{ch}",
+        "availability_topic": MQTT_STATUS_TOPIC,
+        "expire_after":"3600",
+        "suggested_display_precision": 1,
+        "unit_of_measurement": f"°{units}"
+    }
+    payloadH = {
+        "unique_id": f"ws3000_hum_ch{ch}",
+        "name": f"Humidity Sensor {ch}",
+        "state_topic": MQTT_TOPIC + f"/humidity_CH{ch}",
+        "availability_topic": MQTT_STATUS_TOPIC,
+        "expire_after":"3600",
+        "unit_of_measurement": "%",
+        "icon": "mdi:water-percent"
+    }
+    if json_state:
+        # a channel may report only one of its two values, default(None) leaves the
+        # missing entity as unknown instead of failing the template on every poll
+        payloadT["state_topic"] = MQTT_STATE_TOPIC
+        payloadT["value_template"] = f"{{{{ value_json.temperature_CH{ch} | default(None) }}}}"
+        payloadH["state_topic"] = MQTT_STATE_TOPIC
+        payloadH["value_template"] = f"{{{{ value_json.humidity_CH{ch} | default(None) }}}}"
+    return json_dumps(payloadT), json_dumps(payloadH) #convert to JSON
+
 def publish_HAdiscovery(data):
     # Publishing a set of auto discovery messages for Home Assistant
     # base on information from: https://stevessmarthomeguide.com/adding-an-mqtt-device-to-home-assistant/
-    # total number of sensors are passed in from ws-3000 getDeviceConfig function along with temperature units
-    
-    totalSensors = data['sensorNum']
+    # the channels that reported are passed in from ws-3000 getDeviceConfig function along with temperature units
 
     # we're just going to publish a HA discovery message for each available sensor.
     # The state_topic needs to be the same as what is published
     # Eventually the name can be customized from a config file
     # Be careful when running multiple stations, HA will throw exception if unique_ID is duplicated
     # Could add a user provided station ID if multiple ws-3000 is used
-    for ch in range(1,(totalSensors+1)):
-        payloadT = {
-            "unique_id": f"ws3000_temp_ch{ch}",
-            "name": f"Temperature Sensor {ch}",
-            "state_topic": MQTT_TOPIC + f"/temperature_CH{ch}",
-            "availability_topic": MQTT_TOPIC_PREFIX + "/status",
-            "expire_after":"3600",
-            "suggested_display_precision": 1,
-            "unit_of_measurement": f"°{data['units']}"
-        }
-        payloadH = {
-            "unique_id": f"ws3000_hum_ch{ch}",
-            "name": f"Humidity Sensor {ch}",
-            "state_topic": MQTT_TOPIC + f"/humidity_CH{ch}",
-            "availability_topic": MQTT_TOPIC_PREFIX + "/status",
-            "expire_after":"3600",
-            "unit_of_measurement": "%",
-            "icon": "mdi:water-percent"
-        }
+    for ch in data['sensors']:
+        msgT, msgH = discovery_payloads(ch, data['units'], MQTT_JSON_STATE)
         specific_topic = f"homeassistant/sensor/temp_ch{ch}/config"
-        msg = json.dumps(payloadT) #convert to JSON
-        logdbg(f"attempting to publish HA discovery for temperature sensor {ch}")
+        logdbg("attempting to publish HA discovery for temperature sensor %d", ch)
         #publish(client, specific_topic, msg, 0, True)
-        result = client.publish(specific_topic, msg, qos=0, retain=True)
+        result = client.publish(specific_topic, msgT, qos=0, retain=True)
         specific_topic = f"homeassistant/sensor/hum_ch{ch}/config"
-        msg = json.dumps(payloadH) #convert to JSON
-        logdbg(f"attempting to publish HA discovery for humidity sensor {ch}")
+        logdbg("attempting to publish HA discovery for humidity sensor %d", ch)
         #publish(client, specific_topic, msg, 0, True)
-        result = client.publish(specific_topic, msg, qos=0, retain=True)
+        result = client.publish(specific_topic, msgH, qos=0, retain=True)
 
         # make sensors available
         msg = 'online'
-        specific_topic = payloadT['availability_topic']
+        specific_topic = MQTT_STATUS_TOPIC
         result = client.publish(specific_topic, msg, qos=2, retain=True)
 
 # *******************************************************************
@@ -576,7 +736,7 @@ def publish_HAdiscovery(data):
 #
 if __name__ == '__main__':
 
-    import argparse, platform
+    import argparse, platform, signal
     os = platform.system()
 
     parser = argparse.ArgumentParser(description='Poll a WS-3000 base station over USB and publish up to 8 temperatures and humidity over MQTT')
@@ -596,6 +756,8 @@ if __name__ == '__main__':
                         help='specify MQTT broker username, a password must also be used')
     parser.add_argument('--password', default=None,
                         help='specify MQTT broker password, cannot be empty')
+    parser.add_argument('--per-topic', action='store_true',
+                        help='publish each value on its own topic instead of a single JSON state topic')
     options = parser.parse_args()
 
     if options.version:
@@ -613,9 +775,19 @@ if __name__ == '__main__':
     if options.user and options.password:
         client.username_pw_set(options.user,options.password)
 
+    if options.per_topic:
+        MQTT_JSON_STATE = False
+
 #    if options.debug:
 #        syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_DEBUG))
 
+    # a SIGTERM (e.g. systemctl stop) unwinds like Ctrl-C, so the finally blocks
+    # below release the port and the broker; raising is safe from a handler where
+    # setting an Event the main thread is waiting on is not
+    def _sigterm(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, _sigterm)
+
     # Driver mode only reads from USB and print to screen
     if options.test == 'driver':
         driver = WS3000(loop_interval=poll_interval,mode=os)